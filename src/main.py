@@ -1,9 +1,16 @@
 import argparse
+from collections import defaultdict
 import modules.path as path
 import modules.word_freq as word_freq
 import modules.tf_idf as tf_idf
 # import modules.ideation as ideation
 import modules.extract_text as extract_text
+import modules.embedding as embedding
+import modules.database as database
+import modules.pipeline as pipeline
+import modules.partition as partition
+from modules.query_cache import QueryCache
+from modules.sketch import BoundedVocab, EPSILON, DELTA, TOP_K
 
 def app():
 
@@ -13,40 +20,78 @@ def app():
                                      allow_abbrev=True)
     
     parser.add_argument("--displayHelp", action= 'store_true', help= 'Display help message')
+    parser.add_argument("--all", action= 'store_true', help= 'Run text extraction, word frequencies and TF-IDF as one overlapping pipeline')
+    parser.add_argument("--partition", type=partition.parse_partition, metavar="i/N", help="Extract and count words for partition i of N only (by file name hash), writing a self-contained partition database")
+    parser.add_argument("--localPartitions", type=int, metavar="N", help="Run all N partitions as separate local processes, then merge them")
+    parser.add_argument("--mergePartitions", action= 'store_true', help="Merge all partition databases into the main database")
+    parser.add_argument("--partitionDir", default=path.partition_path, help="Folder of the partition databases")
+    parser.add_argument("--chunkSize", type=int, default=1024, help="Number of words per text chunk")
     parser.add_argument("--extractText", action= 'store_true', help= 'Extract text from PDF files and store in database')
     parser.add_argument("--processWordFreq", action= 'store_true', help="Create index tables and analyze word frequencies all in one")
     parser.add_argument("--tokenizePrompt", action= 'store_true', help="Prompt to find references in full database based on context of search")
+    parser.add_argument("--boundedVocab", action= 'store_true', help="Count global word frequencies in fixed space: a count-min sketch for the long tail and exact counts for the top words only")
+    parser.add_argument("--vocabEpsilon", type=float, default=EPSILON, help="With --boundedVocab, maximum overestimate of a count as a fraction of all counted words")
+    parser.add_argument("--vocabDelta", type=float, default=DELTA, help="With --boundedVocab, probability that a count exceeds the --vocabEpsilon bound")
+    parser.add_argument("--vocabTopK", type=int, default=TOP_K, help="With --boundedVocab, number of most frequent words counted exactly")
+    parser.add_argument("--rankPrompt", action= 'store_true', help="Rank documents against PROMPT.txt with the per-document TF-IDF weights (cached until the data changes)")
     parser.add_argument("--computeTFIDF", action= 'store_true', help="Compute TF-IDF of all tokens in database")
+    parser.add_argument("--embedChunks", action= 'store_true', help="Compute offline LSA embeddings of all text chunks in database")
+    parser.add_argument("--profileQueries", action= 'store_true', help="Print the total time spent in each database query after the run")
+    parser.add_argument("--searchChunks", action= 'store_true', help="Find the text chunks most similar to PROMPT.txt using the chunk embeddings")
 
     args = parser.parse_args()
 
     if args.displayHelp:
         print("This project is to meant to store record of learning activities. The files and record of activities are then transfer into database that show user the timeline and activities done in that day. Python is used to extract text from PDF files and store in database. Python also offers a few useful modules to process Natural Language Processing and word processing modules to conviniently analyze word frequencies and word stems to clean up textual data for processing cosine similarity search.")
 
+    query_times = defaultdict(lambda: [0, 0.0])
+    if args.profileQueries:
+        def record_query(sql, elapsed, row_count):
+            query_times[sql][0] += 1
+            query_times[sql][1] += elapsed
+        database.add_query_hook(record_query)
+
+    # Adjust parameters
+    """
+    Small Chunks (50-200 characters): These are useful for quick retrieval 
+    of specific information, such as definitions or short facts. They are 
+    easy to index and search but may lack context.
+
+    Medium Chunks (200-500 characters): Medium chunks are a balance between 
+    detail and brevity, providing enough context to understand a concept 
+    without overwhelming the reader. These are often used in study aids or 
+    summaries.
+
+    Large Chunks (500-2000 characters): Large chunks are better suited for 
+    conveying more complex ideas, detailed explanations, or comprehensive 
+    descriptions. They are more challenging to search but provide deeper 
+    understanding.
+    """
+    chunk_size = args.chunkSize
+    try:
+        bounded_vocab = BoundedVocab(args.vocabEpsilon, args.vocabDelta, args.vocabTopK) if args.boundedVocab else None
+    except ValueError as e:
+        parser.error(str(e))
+
     if args.extractText: # function is functioning properly
-        
-        # Adjust parameters
-        """
-        Small Chunks (50-200 characters): These are useful for quick retrieval 
-        of specific information, such as definitions or short facts. They are 
-        easy to index and search but may lack context.
-
-        Medium Chunks (200-500 characters): Medium chunks are a balance between 
-        detail and brevity, providing enough context to understand a concept 
-        without overwhelming the reader. These are often used in study aids or 
-        summaries.
-
-        Large Chunks (500-2000 characters): Large chunks are better suited for 
-        conveying more complex ideas, detailed explanations, or comprehensive 
-        descriptions. They are more challenging to search but provide deeper 
-        understanding.
-        """
-        chunk_size = 1024
         # extract_text
         extract_text.extract_text(CHUNK_SIZE=chunk_size, SOURCE_FOLDER=path.source_data, DB_PATH=path.chunk_database_path, DEST_FOLDER=path.dest_data)
+
+    if args.all:
+        pipeline.run_all(SOURCE_FOLDER=path.source_data, CHUNK_SIZE=chunk_size, DB_PATH=path.chunk_database_path, bounded_vocab=bounded_vocab)
     
+    if args.partition:
+        index, total = args.partition
+        partition.run_partition(index, total, SOURCE_FOLDER=path.source_data, OUTPUT_DIR=args.partitionDir, CHUNK_SIZE=chunk_size)
+
+    if args.localPartitions:
+        partition.run_local_partitions(args.localPartitions, SOURCE_FOLDER=path.source_data, OUTPUT_DIR=args.partitionDir, CHUNK_SIZE=chunk_size)
+
+    if args.mergePartitions or args.localPartitions:
+        partition.merge_partitions(PARTITION_DIR=args.partitionDir, DB_PATH=path.chunk_database_path, bounded_vocab=bounded_vocab)
+
     if args.processWordFreq:
-        word_freq.process_word_frequencies_in_batches(reset_state=False)
+        word_freq.process_word_frequencies_in_batches(reset_state=False, bounded_vocab=bounded_vocab)
 
     if args.tokenizePrompt: # function is functioning properly
         word_freq.promptFindingReference()
@@ -54,5 +99,28 @@ def app():
     if args.computeTFIDF:
         tf_idf.computeTFIDF()
 
+    if args.rankPrompt:
+        cleaned_prompt = word_freq.promptFindingReference()
+        query_cache = QueryCache()
+        results = query_cache.lookup("rank_documents", dict(cleaned_prompt), tf_idf.rank_documents, top_n=10)
+        for file_name, score in results:
+            print(f"{score:.4f}  {file_name}")
+        query_cache.flush()
+
+    if args.embedChunks:
+        embedding.embed_chunks()
+
+    if args.searchChunks:
+        with open("PROMPT.txt", "r", encoding="utf-8", errors="ignore") as f:
+            prompt = f.read()
+        for file_name, chunk_id, score in embedding.search_similar_chunks(prompt, top_k=10):
+            print(f"{score:.4f}  {file_name} [chunk {chunk_id}]")
+
+    if args.profileQueries:
+        for sql, (calls, elapsed) in sorted(query_times.items(), key=lambda item: -item[1][1]):
+            print(f"{elapsed:9.3f}s  {calls:7d} calls  {' '.join(sql.split())[:100]}")
+
+    database.close_all()
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
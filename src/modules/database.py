@@ -0,0 +1,236 @@
+import os
+import sqlite3
+import threading
+import time
+
+from modules.path import chunk_database_path
+
+# --- Config ---
+
+# SQLite limits the number of host parameters in a statement (999 on older builds)
+MAX_IN_PARAMS = 900
+# Above this many keys, lookups go through a temporary table instead of chunked IN lists
+TEMP_TABLE_THRESHOLD = 5000
+
+PRAGMA_PROFILES = {
+    "read": {
+        "mmap_size": 268435456,   # 256 MB memory-mapped I/O
+        "cache_size": -65536,     # 64 MB page cache
+        "temp_store": "MEMORY",
+    },
+    "write": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",  # Durable with WAL; only the last commits can be lost on power failure
+        "busy_timeout": 30000,    # Wait for concurrent writers instead of failing
+        "mmap_size": 268435456,
+        "cache_size": -131072,    # 128 MB page cache
+        "temp_store": "MEMORY",
+    },
+}
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Shared SQLite access layer.
+1. One pooled connection per (process, thread, database, profile), reused across calls
+2. Consistent pragma profiles for reading and writing
+3. Bulk IN / temporary table lookups instead of one query per key
+4. Query timing hooks on every pooled connection
+5. A data version counter for invalidating cached query results
+"""
+
+_local = threading.local()
+_pools_lock = threading.Lock()
+_pools = []  # (pid, thread, pool) of every thread that opened a pooled connection
+_generation = 0  # Bumped by close_all; a thread whose pool is older starts a new, registered one
+_query_hooks = []
+
+def get_connection(db_path=chunk_database_path, profile="read"):
+    """
+    Return the pooled connection of the calling thread for `db_path` opened with
+    the pragma `profile` ("read" or "write"). The connection is created on first
+    use and reused afterwards; a forked process never inherits its parent's pool.
+    """
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown pragma profile: {profile}")
+
+    pool = getattr(_local, "pool", None)
+    if pool is None or getattr(_local, "pid", None) != os.getpid() or getattr(_local, "generation", None) != _generation:
+        pool = _local.pool = {}
+        _local.pid = os.getpid()
+        with _pools_lock:
+            _local.generation = _generation
+            _prune_dead_pools()
+            _pools.append((os.getpid(), threading.current_thread(), pool))
+
+    key = (db_path, profile)
+    conn = pool.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, factory=TimedConnection)
+        apply_pragmas(conn, profile)
+        pool[key] = conn
+    return conn
+
+def apply_pragmas(conn, profile):
+    """Apply the pragmas of `profile` to an open connection."""
+    for name, value in PRAGMA_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {name} = {value};")
+
+def _close_pool(pool):
+    for conn in pool.values():
+        conn.close()
+    pool.clear()
+
+def _prune_dead_pools():
+    """Close the pools of finished threads (e.g. short-lived executor workers). Caller holds _pools_lock."""
+    pid = os.getpid()
+    remaining = []
+    for owner, thread, pool in _pools:
+        if owner != pid:
+            continue  # Inherited from the parent process; its connections belong to the parent
+        if thread.is_alive():
+            remaining.append((owner, thread, pool))
+        else:
+            _close_pool(pool)
+    _pools[:] = remaining
+
+def close_all():
+    """
+    Close every pooled connection opened by the current process. The pools of all threads
+    are emptied and retired, so any thread that keeps running opens (and registers) a new
+    pool on its next call.
+    """
+    global _generation
+    pid = os.getpid()
+    with _pools_lock:
+        _generation += 1
+        for owner, _, pool in _pools:
+            if owner == pid:
+                _close_pool(pool)
+        _pools[:] = []
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def add_query_hook(hook):
+    """
+    Register `hook(sql, elapsed_seconds, row_count)`, called after every statement
+    executed on a pooled connection. For SELECT statements `row_count` is -1 and the
+    time covers preparing the statement and producing the first row.
+    """
+    _query_hooks.append(hook)
+
+def remove_query_hook(hook):
+    """Unregister a hook added with `add_query_hook`."""
+    if hook in _query_hooks:
+        _query_hooks.remove(hook)
+
+def _report(sql, start, cursor):
+    elapsed = time.perf_counter() - start
+    for hook in _query_hooks:
+        hook(sql, elapsed, cursor.rowcount)
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports every execute/executemany to the query hooks."""
+
+    def execute(self, sql, parameters=()):
+        if not _query_hooks:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        _report(sql, start, cursor)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _query_hooks:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        _report(sql, start, cursor)
+        return cursor
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including the implicit ones of execute) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def fetch_in(conn, sql, keys):
+    """
+    Run `sql` for many keys at once and return all rows.
+
+    `sql` contains a single `{keys}` placeholder where the key set goes, e.g.
+    "SELECT id, file_name FROM file_info WHERE id IN {keys}". Small key sets are
+    sent as chunked IN lists; large ones are loaded into a temporary table.
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+
+    if len(keys) > TEMP_TABLE_THRESHOLD:
+        # A savepoint nests inside a transaction the caller may have open, so the
+        # caller's pending writes are neither committed nor rolled back here
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _lookup_keys (key PRIMARY KEY) WITHOUT ROWID;")
+        conn.execute("SAVEPOINT fetch_in;")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO _lookup_keys (key) VALUES (?);", ((key,) for key in keys))
+            rows = conn.execute(sql.format(keys="(SELECT key FROM _lookup_keys)")).fetchall()
+        finally:
+            conn.execute("ROLLBACK TO fetch_in;")  # Discards the loaded keys
+            conn.execute("RELEASE fetch_in;")
+        return rows
+
+    rows = []
+    for start in range(0, len(keys), MAX_IN_PARAMS):
+        batch = keys[start:start + MAX_IN_PARAMS]
+        placeholders = "(" + ", ".join("?" * len(batch)) + ")"
+        rows.extend(conn.execute(sql.format(keys=placeholders), batch).fetchall())
+    return rows
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def bump_data_version(conn):
+    """
+    Increment the data version counter inside the caller's transaction. Every write to
+    chunks, word frequencies or TF-IDF weights bumps it, which invalidates cached query results.
+
+    The row also holds a random generation id, written when the row is created: a database
+    that is deleted and rebuilt restarts its counter at 1 but gets a new generation.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL,
+            generation TEXT
+        )
+    """)
+    columns = set(row[1] for row in conn.execute("PRAGMA table_info(data_version)").fetchall())
+    if "generation" not in columns:
+        conn.execute("ALTER TABLE data_version ADD COLUMN generation TEXT")
+    # Rows from before the generation column get theirs on the next bump
+    conn.execute("""
+        INSERT INTO data_version (id, version, generation) VALUES (0, 1, ?)
+        ON CONFLICT(id) DO UPDATE SET version = version + 1, generation = COALESCE(generation, excluded.generation)
+    """, (os.urandom(16).hex(),))
+
+def get_data_version(conn):
+    """
+    Return the current (generation, version) of the data. The generation is None if nothing
+    has been written since the data version was introduced, so results cannot be cached yet.
+    """
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='data_version';")
+    if cursor.fetchone() is None:
+        return None, 0
+    columns = set(row[1] for row in conn.execute("PRAGMA table_info(data_version)").fetchall())
+    if "generation" not in columns:
+        return None, 0
+    row = conn.execute("SELECT generation, version FROM data_version WHERE id = 0").fetchone()
+    return (row[0], row[1]) if row else (None, 0)
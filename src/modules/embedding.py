@@ -0,0 +1,195 @@
+import re
+import zlib
+from json import dump, load
+
+import numpy as np
+
+from modules.database import get_connection
+from modules.path import chunk_database_path, embedding_path, embedding_ids_path, embedding_model_path
+
+# --- Config ---
+
+N_FEATURES = 2 ** 14     # Hashed vocabulary size (columns of the TF-IDF matrix)
+N_COMPONENTS = 128       # Dimension of the dense chunk vectors
+N_OVERSAMPLES = 10       # Extra random directions for the randomized SVD
+N_POWER_ITER = 2         # Power iterations to sharpen the leading subspace
+BATCH_SIZE = 512         # Chunks loaded from the database at once
+RANDOM_SEED = 42
+
+TOKEN_PATTERN = re.compile(r"[a-z]{2,}")
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Offline chunk embeddings (LSA) for the pdf_chunks table.
+1. Hash the tokens of every chunk into a fixed number of TF-IDF columns
+2. Find the leading singular vectors of the corpus matrix with a streamed randomized SVD
+3. Project every chunk onto those vectors and store the L2-normalized result
+   as a float32 .npy memory map, together with a (file_name, chunk_id) id map
+4. Answer similarity queries with a single matrix-vector product over the memory map
+"""
+
+def hash_tokens(text, n_features=N_FEATURES):
+    """Map the tokens of `text` to hashed column indices (crc32 is stable across runs)."""
+    return [zlib.crc32(token.encode("utf-8")) % n_features for token in TOKEN_PATTERN.findall(text.lower())]
+
+def texts_to_counts(texts, n_features=N_FEATURES):
+    """Build a dense (len(texts), n_features) float32 term count matrix with log-scaled counts."""
+    counts = np.zeros((len(texts), n_features), dtype=np.float32)
+    for row, text in enumerate(texts):
+        columns = hash_tokens(text, n_features)
+        if columns:
+            np.add.at(counts[row], columns, 1.0)
+    np.log1p(counts, out=counts)
+    return counts
+
+def iter_chunk_batches(db_path, batch_size=BATCH_SIZE):
+    """Yield (ids, texts) batches from pdf_chunks in a stable order without loading the table."""
+    cursor = get_connection(db_path, "read").cursor()
+    try:
+        cursor.execute("SELECT file_name, chunk_id, chunk_text FROM pdf_chunks ORDER BY file_name, chunk_id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(row[0], row[1]) for row in rows], [row[2] or "" for row in rows]
+    finally:
+        cursor.close()
+
+def iter_tfidf_batches(db_path, idf, batch_size=BATCH_SIZE):
+    """Yield (ids, matrix) batches of the idf-weighted, row-normalized hashed TF-IDF matrix."""
+    for ids, texts in iter_chunk_batches(db_path, batch_size):
+        matrix = texts_to_counts(texts, idf.shape[0])
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        yield ids, matrix
+
+def compute_idf(db_path, n_features=N_FEATURES, batch_size=BATCH_SIZE):
+    """First pass: count the number of chunks each hashed column appears in."""
+    doc_freq = np.zeros(n_features, dtype=np.int64)
+    n_docs = 0
+    for _, texts in iter_chunk_batches(db_path, batch_size):
+        doc_freq += (texts_to_counts(texts, n_features) > 0).sum(axis=0)
+        n_docs += len(texts)
+    idf = (np.log((1 + n_docs) / (1 + doc_freq)) + 1).astype(np.float32)
+    return idf, n_docs
+
+def randomized_components(db_path, idf, n_components=N_COMPONENTS, n_oversamples=N_OVERSAMPLES,
+                          n_power_iter=N_POWER_ITER, batch_size=BATCH_SIZE, seed=RANDOM_SEED):
+    """
+    Streamed randomized truncated SVD of the TF-IDF matrix X.
+
+    Only (n_features, n_components + n_oversamples) matrices are held in memory: every
+    pass accumulates X^T (X Q) batch by batch, which is a power iteration on X^T X.
+    The final small Gram matrix (X Q)^T (X Q) is eigendecomposed to rotate the basis
+    onto the right singular vectors.
+
+    Returns
+    -------
+    numpy.ndarray
+        A (n_features, n_components) float32 projection matrix.
+    """
+    rng = np.random.default_rng(seed)
+    n_features = idf.shape[0]
+    rank = min(n_components + n_oversamples, n_features)
+    basis = rng.standard_normal((n_features, rank)).astype(np.float32)
+
+    for _ in range(n_power_iter + 1):
+        accumulated = np.zeros((n_features, rank), dtype=np.float32)
+        for _, matrix in iter_tfidf_batches(db_path, idf, batch_size):
+            accumulated += matrix.T @ (matrix @ basis)
+        basis, _ = np.linalg.qr(accumulated)
+
+    gram = np.zeros((rank, rank), dtype=np.float64)
+    for _, matrix in iter_tfidf_batches(db_path, idf, batch_size):
+        projected = matrix @ basis
+        gram += projected.T @ projected
+
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    return (basis @ eigenvectors[:, order]).astype(np.float32)
+
+def project(matrix, components):
+    """Project TF-IDF rows onto the components and L2-normalize the result."""
+    vectors = matrix @ components
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def embed_chunks(DB_PATH=chunk_database_path, EMBEDDING_PATH=embedding_path, IDS_PATH=embedding_ids_path,
+                 MODEL_PATH=embedding_model_path, N_COMPONENTS=N_COMPONENTS, BATCH_SIZE=BATCH_SIZE):
+    """
+    Compute a dense vector for every row of pdf_chunks and store it in a float32 .npy
+    memory map at EMBEDDING_PATH. Row i of the map belongs to IDS_PATH[i], a
+    [file_name, chunk_id] pair. The idf weights and projection matrix are stored in
+    MODEL_PATH so that prompts can be embedded into the same space.
+    """
+    print("[INFO] Computing document frequencies of hashed tokens...")
+    idf, n_docs = compute_idf(DB_PATH, N_FEATURES, BATCH_SIZE)
+    if n_docs == 0:
+        print("[INFO] No chunks found in database. Nothing to embed.")
+        return
+
+    n_components = min(N_COMPONENTS, n_docs, N_FEATURES)
+    print(f"[INFO] Fitting {n_components} LSA components over {n_docs} chunks...")
+    components = randomized_components(DB_PATH, idf, n_components=n_components, batch_size=BATCH_SIZE)
+
+    print("[INFO] Writing chunk embeddings...")
+    vectors = np.lib.format.open_memmap(EMBEDDING_PATH, mode="w+", dtype=np.float32, shape=(n_docs, n_components))
+    chunk_ids = []
+    offset = 0
+    for ids, matrix in iter_tfidf_batches(DB_PATH, idf, BATCH_SIZE):
+        # Guard against rows inserted between passes
+        ids = ids[:n_docs - offset]
+        vectors[offset:offset + len(ids)] = project(matrix[:len(ids)], components)
+        chunk_ids.extend(ids)
+        offset += len(ids)
+        if offset >= n_docs:
+            break
+    vectors.flush()
+    del vectors
+
+    with open(IDS_PATH, "w", encoding="utf-8") as f:
+        dump(chunk_ids, f, ensure_ascii=False)
+    np.savez(MODEL_PATH, idf=idf, components=components)
+    print(f"[INFO] Stored {offset} chunk embeddings of dimension {n_components}.")
+
+def load_embeddings(EMBEDDING_PATH=embedding_path, IDS_PATH=embedding_ids_path):
+    """Open the chunk vectors as a read-only memory map (no copy) together with their ids."""
+    vectors = np.load(EMBEDDING_PATH, mmap_mode="r")
+    with open(IDS_PATH, "r", encoding="utf-8") as f:
+        chunk_ids = load(f)
+    return vectors, chunk_ids
+
+def embed_text(text, MODEL_PATH=embedding_model_path):
+    """Embed a free-form text into the space of the stored chunk vectors."""
+    with np.load(MODEL_PATH) as model:
+        idf, components = model["idf"], model["components"]
+    matrix = texts_to_counts([text], idf.shape[0]) * idf
+    norm = np.linalg.norm(matrix)
+    if norm > 0:
+        matrix /= norm
+    return project(matrix, components)[0]
+
+def search_similar_chunks(text, top_k=10, EMBEDDING_PATH=embedding_path, IDS_PATH=embedding_ids_path,
+                          MODEL_PATH=embedding_model_path):
+    """
+    Return the `top_k` chunks most similar to `text` as (file_name, chunk_id, score) tuples,
+    ordered by decreasing cosine similarity. The scores are computed with one
+    matrix-vector product over the memory-mapped vectors.
+    """
+    vectors, chunk_ids = load_embeddings(EMBEDDING_PATH, IDS_PATH)
+    if len(chunk_ids) == 0:
+        return []
+
+    query = embed_text(text, MODEL_PATH)
+    scores = vectors @ query
+    top_k = min(top_k, scores.shape[0])
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best])]
+    return [(chunk_ids[i][0], chunk_ids[i][1], float(scores[i])) for i in best]
@@ -1,13 +1,15 @@
 import concurrent.futures as cf
 import os
-import sqlite3
 import re
+from itertools import islice
 
+from modules.database import get_connection, bump_data_version
 from modules.path import chunk_database_path
 
 # --- Config ---
 
 BATCH_SIZE = 100
+CHUNK_WINDOW = 2 * (os.cpu_count() or 4)  # Files chunked (and held in memory) at once
 
 # -----------------------------------------------------------------------------------------------
 # -----------------------------------------------------------------------------------------------
@@ -16,7 +18,7 @@ BATCH_SIZE = 100
 From a raw dataset,
 1. Refine the text (remove special characters, reduce multiple spaces)
 2. Chunk the text into chunks of size chunk_size
-3. Create embeddings for each chunk
+3. Create embeddings for each chunk (see modules.embedding)
 4. Save text chunks and embeddings to a database
 """
 
@@ -56,17 +58,45 @@ def save_chunks_to_file(file_path, chunks):
         for chunk in chunks:
             f.write(f"{chunk}\n")
         
+def chunk_file(file, source_folder, chunk_size, overlap_size):
+    """Read, clean and chunk a single file from source_folder."""
+    with open(os.path.join(source_folder, file), "r", encoding="utf-8") as f:
+        raw_text = f.read()
+
+    cleaned_text = clean_text_for_extracted_data(raw_text)
+    return text_to_chunks(cleaned_text, chunk_size, overlap = overlap_size)
+
+def iter_chunked_files(files, source_folder, chunk_size, overlap_size, window=CHUNK_WINDOW):
+    """
+    Chunk files in a thread pool and yield (file, chunks, error) as each one finishes.
+    At most `window` files are submitted at a time and each result is released once
+    yielded, so memory depends on the window, not on the number of files.
+    """
+    files = iter(files)
+    with cf.ThreadPoolExecutor() as executor:
+        in_flight = {
+            executor.submit(chunk_file, f, source_folder, chunk_size, overlap_size): f
+            for f in islice(files, window)
+        }
+        while in_flight:
+            done, _ = cf.wait(in_flight, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                file = in_flight.pop(future)
+                for next_file in islice(files, 1):
+                    in_flight[executor.submit(chunk_file, next_file, source_folder, chunk_size, overlap_size)] = next_file
+                try:
+                    chunks, error = future.result(), None
+                except Exception as e:
+                    chunks, error = None, e
+                yield file, chunks, error
+
 def process_file(file, source_folder, chunk_size, dataset_folder, overlap_size):
     """Read and chunk a file, saving the output to dataset_folder."""
     if not file.endswith(".txt"):
         return
 
     try:
-        with open(os.path.join(source_folder, file), "r", encoding="utf-8") as f:
-            raw_text = f.read()
-
-        cleaned_text = clean_text_for_extracted_data(raw_text)
-        chunks = text_to_chunks(cleaned_text, chunk_size, overlap = overlap_size)
+        chunks = chunk_file(file, source_folder, chunk_size, overlap_size)
 
         output_path = os.path.join(dataset_folder, file)
         save_chunks_to_file(output_path, chunks)
@@ -74,9 +104,33 @@ def process_file(file, source_folder, chunk_size, dataset_folder, overlap_size):
     except Exception as e:
         print(f"[ERROR] Failed to process {file}: {e}")
 
+def insert_file_chunks(cursor, file, chunks, overlap_size):
+    """Insert the chunks of a single file into pdf_chunks."""
+    # Prepare data for batch insertion
+    data_to_insert = []
+    for chunk_id, chunk_text in enumerate(chunks):
+        chunk_text = chunk_text.strip()
+        word_count = len(chunk_text.split())
+        
+        data_to_insert.append((
+            file, 
+            chunk_id, 
+            chunk_text, 
+            word_count, 
+            overlap_size
+        ))
+
+    # Batch execution is significantly faster
+    cursor.executemany("""
+        INSERT OR IGNORE INTO pdf_chunks 
+        (file_name, chunk_id, chunk_text, word_count, overlap_size)
+        VALUES (?, ?, ?, ?, ?)
+    """, data_to_insert)
+    bump_data_version(cursor.connection)
+
 def insert_chunks_into_db(dataset_folder, db_path, overlap_size):
     print("[INFO] Inserting chunks into database...")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path, "write")
     cursor = conn.cursor()
 
     for file in os.listdir(dataset_folder):
@@ -85,26 +139,7 @@ def insert_chunks_into_db(dataset_folder, db_path, overlap_size):
             with open(file_path, "r", encoding="utf-8") as f:
                 lines = f.readlines()
 
-            # Prepare data for batch insertion
-            data_to_insert = []
-            for chunk_id, chunk_text in enumerate(lines):
-                chunk_text = chunk_text.strip()
-                word_count = len(chunk_text.split())
-                
-                data_to_insert.append((
-                    file, 
-                    chunk_id, 
-                    chunk_text, 
-                    word_count, 
-                    overlap_size
-                ))
-
-            # Batch execution is significantly faster
-            cursor.executemany("""
-                INSERT OR IGNORE INTO pdf_chunks 
-                (file_name, chunk_id, chunk_text, word_count, overlap_size)
-                VALUES (?, ?, ?, ?, ?)
-            """, data_to_insert)
+            insert_file_chunks(cursor, file, lines, overlap_size)
 
         except Exception as e:
             print(f"[ERROR] Failed to insert chunks from {file}: {e}")
@@ -112,23 +147,10 @@ def insert_chunks_into_db(dataset_folder, db_path, overlap_size):
         os.remove(file_path)
 
     conn.commit()
-    conn.close()
     print("[INFO] Database insertion completed.")
 
-# -----------------------------------------------------------------------------------------------
-# -----------------------------------------------------------------------------------------------
-
-def extract_text(SOURCE_FOLDER, DEST_FOLDER, CHUNK_SIZE=512, DB_PATH=chunk_database_path):
-    """
-    Processes .txt files in SOURCE_FOLDER by chunking their text and storing the results
-    in a SQLite database at DB_PATH.
-    """
-    os.makedirs(DEST_FOLDER, exist_ok=True)
-
-    # Step 1: Setup Database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+def create_chunk_table(conn):
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS pdf_chunks (
             file_name TEXT,
             chunk_id INTEGER,
@@ -140,20 +162,36 @@ def extract_text(SOURCE_FOLDER, DEST_FOLDER, CHUNK_SIZE=512, DB_PATH=chunk_datab
     """)
     conn.commit()
 
-    # Step 2: Process new files
-    raw_files = set([f for f in os.listdir(SOURCE_FOLDER) if f.endswith(".txt")])
-    zero_byte_files = set([f for f in os.listdir(SOURCE_FOLDER) if os.path.getsize(os.path.join(SOURCE_FOLDER, f)) == 0])
+def find_new_files(cursor, source_folder):
+    """
+    Return (new_files, num_raw_files, num_zero) where new_files is the set of non-empty
+    .txt files in source_folder that have no chunks in the database yet.
+    """
+    raw_files = set([f for f in os.listdir(source_folder) if f.endswith(".txt")])
+    zero_byte_files = set([f for f in os.listdir(source_folder) if os.path.getsize(os.path.join(source_folder, f)) == 0])
     completed_files = cursor.execute("SELECT DISTINCT file_name FROM pdf_chunks").fetchall()
     completed_files = set([f[0] for f in completed_files])
     new_files = raw_files - completed_files - zero_byte_files
-    
-    num_raw_files = len(raw_files)
-    num_zero = len(zero_byte_files)
-    overlap_size = int(CHUNK_SIZE * 0.3)  # Assuming 30% overlap
+    return new_files, len(raw_files), len(zero_byte_files)
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def extract_text(SOURCE_FOLDER, DEST_FOLDER, CHUNK_SIZE=512, DB_PATH=chunk_database_path):
+    """
+    Processes .txt files in SOURCE_FOLDER by chunking their text and storing the results
+    in a SQLite database at DB_PATH.
+    """
+    os.makedirs(DEST_FOLDER, exist_ok=True)
 
-    del raw_files
-    del zero_byte_files
-    del completed_files
+    # Step 1: Setup Database
+    conn = get_connection(DB_PATH, "write")
+    cursor = conn.cursor()
+    create_chunk_table(conn)
+
+    # Step 2: Process new files
+    new_files, num_raw_files, num_zero = find_new_files(cursor, SOURCE_FOLDER)
+    overlap_size = int(CHUNK_SIZE * 0.3)  # Assuming 30% overlap
 
     if not new_files:
         print("[INFO] No new files to process.")
@@ -174,4 +212,3 @@ def extract_text(SOURCE_FOLDER, DEST_FOLDER, CHUNK_SIZE=512, DB_PATH=chunk_datab
     # Check if all files have been processed
     num_completed = cursor.execute("SELECT COUNT(DISTINCT file_name) FROM pdf_chunks").fetchone()[0]
     print(f"[INFO] {num_completed}/{num_raw_files - num_zero} files processed.")
-    conn.close()
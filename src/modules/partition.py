@@ -0,0 +1,199 @@
+import argparse
+import concurrent.futures as cf
+import os
+import re
+import subprocess
+import sys
+import zlib
+from functools import partial
+
+from modules.database import get_connection, bump_data_version
+from modules.extract_text import create_chunk_table, insert_file_chunks, iter_chunked_files
+from modules.path import chunk_database_path, token_json_path, partition_path
+from modules.word_freq import (CHECKPOINT_EVERY, checkpoint, create_title_word_freq_table, export_global_word_freq,
+                               init_global_freq_store, merge_title_counts, retrieve_token_list, write_missing_title_json,
+                               write_title_json)
+
+PARTITION_FILE_PATTERN = re.compile(r"^partition_(\d+)_of_(\d+)\.db$")
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Partitioned processing across processes, containers or hosts.
+1. `--partition i/N` processes only the source files whose stable name hash falls in partition i
+2. Each partition writes one self-contained database: chunks and per-title word counts
+3. `--mergePartitions` combines all partition databases into the main database in partition
+   order, so the result does not depend on which partition finished first
+"""
+
+def parse_partition(spec):
+    """Parse an "i/N" partition spec into (index, total); used as an argparse type."""
+    match = re.fullmatch(r"(\d+)/(\d+)", spec.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Partition must look like i/N, got: {spec}")
+    index, total = int(match.group(1)), int(match.group(2))
+    if total < 1 or index >= total:
+        raise argparse.ArgumentTypeError(f"Partition index must be in [0, N), got: {spec}")
+    return index, total
+
+def partition_of(file_name, total):
+    """Stable partition of a file name (crc32, identical on every host and run)."""
+    return zlib.crc32(file_name.encode("utf-8")) % total
+
+def partition_db_path(output_dir, index, total):
+    return os.path.join(output_dir, f"partition_{index}_of_{total}.db")
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def run_partition(index, total, SOURCE_FOLDER, OUTPUT_DIR=partition_path, CHUNK_SIZE=512):
+    """
+    Chunk and count the words of every source file in partition `index` of `total`, writing
+    everything to OUTPUT_DIR/partition_<index>_of_<total>.db. Files and titles already present
+    in that database are skipped, so an interrupted partition can simply be rerun.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    db_path = partition_db_path(OUTPUT_DIR, index, total)
+    conn = get_connection(db_path, "write")
+    cursor = conn.cursor()
+    create_chunk_table(conn)
+    create_title_word_freq_table(conn)
+    conn.commit()
+
+    # Step 1: Chunk the files of this partition
+    files = sorted(
+        f for f in os.listdir(SOURCE_FOLDER)
+        if f.endswith(".txt") and partition_of(f, total) == index
+        and os.path.getsize(os.path.join(SOURCE_FOLDER, f)) > 0
+    )
+    completed_files = set(row[0] for row in cursor.execute("SELECT DISTINCT file_name FROM pdf_chunks").fetchall())
+    new_files = [f for f in files if f not in completed_files]
+    overlap_size = int(CHUNK_SIZE * 0.3)  # Assuming 30% overlap
+    print(f"[INFO] Partition {index}/{total}: {len(files)} files, {len(new_files)} new.")
+
+    for file, chunks, error in iter_chunked_files(new_files, SOURCE_FOLDER, CHUNK_SIZE, overlap_size):
+        if error is not None:
+            print(f"[ERROR] Failed to process {file}: {error}")
+            continue
+        try:
+            insert_file_chunks(cursor, file, chunks, overlap_size)
+            conn.commit()
+        except Exception as e:
+            print(f"[ERROR] Failed to process {file}: {e}")
+
+    # Step 2: Count words per title
+    counted = set(row[0] for row in cursor.execute("SELECT DISTINCT file_name FROM title_word_freq").fetchall())
+    titles = [
+        row[0].removesuffix(".txt")
+        for row in cursor.execute("SELECT DISTINCT file_name FROM pdf_chunks ORDER BY file_name").fetchall()
+    ]
+    titles = [title for title in titles if title not in counted]
+    retrieve_func = partial(retrieve_token_list, database=db_path)
+
+    with cf.ThreadPoolExecutor() as executor:
+        for title, word_freq in zip(titles, executor.map(retrieve_func, titles)):
+            if not word_freq:
+                continue
+            cursor.executemany(
+                "INSERT OR REPLACE INTO title_word_freq (file_name, word, freq) VALUES (?, ?, ?)",
+                ((title, word, freq) for word, freq in word_freq.items()),
+            )
+            conn.commit()
+
+    print(f"[INFO] Partition {index}/{total} written to {db_path}.")
+
+def run_local_partitions(total, SOURCE_FOLDER, OUTPUT_DIR=partition_path, CHUNK_SIZE=512):
+    """Run all `total` partitions as separate local processes and wait for them."""
+    main_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    processes = [
+        subprocess.Popen([sys.executable, main_script, "--partition", f"{index}/{total}",
+                          "--partitionDir", OUTPUT_DIR, "--chunkSize", str(CHUNK_SIZE)])
+        for index in range(total)
+    ]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Partitions {failed} of {total} failed.")
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def find_partitions(partition_dir):
+    """Return the sorted [(index, total, path)] of partition databases in partition_dir."""
+    partitions = []
+    for file in os.listdir(partition_dir):
+        match = PARTITION_FILE_PATTERN.match(file)
+        if match:
+            partitions.append((int(match.group(1)), int(match.group(2)), os.path.join(partition_dir, file)))
+    return sorted(partitions)
+
+def merge_partitions(PARTITION_DIR=partition_path, DB_PATH=chunk_database_path, FOLDER_PATH=token_json_path,
+                     bounded_vocab=None):
+    """
+    Merge every partition database in PARTITION_DIR into DB_PATH.
+
+    Chunks are copied in partition order. The per-title counts of every title not merged yet
+    are added to title_word_freq and the global word frequencies exactly once, and the global
+    JSON file is exported. Title JSON files need an id in file_info; titles
+    without one are reported and get their file on a later merge or --processWordFreq.
+    """
+    partitions = find_partitions(PARTITION_DIR)
+    if not partitions:
+        print(f"[INFO] No partition databases found in {PARTITION_DIR}.")
+        return
+    totals = set(total for _, total, _ in partitions)
+    if len(totals) != 1:
+        raise ValueError(f"Partition databases from different partition counts: {sorted(totals)}")
+    total = totals.pop()
+    missing = sorted(set(range(total)) - set(index for index, _, _ in partitions))
+    if missing:
+        print(f"[WARNING] Missing partitions {missing} of {total}; merging the others.")
+
+    conn = get_connection(DB_PATH, "write")
+    cursor = conn.cursor()
+    create_chunk_table(conn)
+    init_global_freq_store(conn, bounded_vocab=bounded_vocab)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_info';")
+    title_ids = dict(cursor.execute("SELECT file_name, id FROM file_info").fetchall()) if cursor.fetchone() else {}
+    os.makedirs(FOLDER_PATH, exist_ok=True)
+
+    merged = 0
+    for index, _, path in partitions:
+        conn.execute("ATTACH DATABASE ? AS part", (path,))
+        conn.execute("""
+            INSERT OR IGNORE INTO pdf_chunks (file_name, chunk_id, chunk_text, word_count, overlap_size)
+            SELECT file_name, chunk_id, chunk_text, word_count, overlap_size FROM part.pdf_chunks
+        """)
+        bump_data_version(conn)
+        conn.commit()
+
+        titles = [row[0] for row in cursor.execute("""
+            SELECT DISTINCT file_name FROM part.title_word_freq
+            WHERE file_name NOT IN (SELECT file_name FROM word_freq_journal)
+            ORDER BY file_name
+        """).fetchall()]
+        pending = 0
+        for title in titles:
+            word_freq = dict(cursor.execute("SELECT word, freq FROM part.title_word_freq WHERE file_name = ?", (title,)).fetchall())
+            title_id = title_ids.get(title)
+            merge_title_counts(conn, title, word_freq, title_id, bounded_vocab)
+            if title_id is not None:
+                write_title_json(title_id, word_freq, FOLDER_PATH)
+            pending += 1
+            if pending >= CHECKPOINT_EVERY:
+                checkpoint(conn)
+                pending = 0
+        checkpoint(conn)
+        merged += len(titles)
+
+        conn.execute("DETACH DATABASE part")
+        print(f"[INFO] Merged partition {index}/{total}.")
+    print(f"[INFO] Merged word frequencies of {merged} titles.")
+
+    # Titles merged now or by an earlier merge that only got their file_info id since
+    unnamed = write_missing_title_json(conn, FOLDER_PATH)
+    if unnamed:
+        print(f"[INFO] {unnamed} titles have no entry in file_info yet; run --updateDatabaseInformation and merge again to write their title JSON files.")
+
+    export_global_word_freq(conn, bounded_vocab=bounded_vocab)
@@ -1,14 +1,25 @@
-from os import getcwd
+from os import getcwd, environ, sep
+from os.path import join
 
-StudyApp_root_path = getcwd() + "\\"
+# Every root can be overridden through the environment, e.g. to run several
+# partitions (see modules.partition) on other machines or in containers.
+StudyApp_root_path = environ.get("STUDYAPP_ROOT", getcwd()) + sep
+data_root = environ.get("STUDYAPP_DATA_ROOT", join(StudyApp_root_path, "data"))
 
-pdf_path = "D:\\READING LIST"
-source_data = "D:\\reading_raw_dataset"
-dest_data = "D:\\reading_refined_dataset"
+pdf_path = environ.get("STUDYAPP_PDF_PATH", "D:\\READING LIST")
+source_data = environ.get("STUDYAPP_SOURCE_DATA", "D:\\reading_raw_dataset")
+dest_data = environ.get("STUDYAPP_DEST_DATA", "D:\\reading_refined_dataset")
 
-chunk_database_path = StudyApp_root_path + "data\\pdf_text.db"
-token_json_path = StudyApp_root_path + "data\\token_json"
+chunk_database_path = join(data_root, "pdf_text.db")
+token_json_path = join(data_root, "token_json")
+partition_path = join(data_root, "partitions")
 
-log_file_path = StudyApp_root_path + "data\\process.log"
-buffer_json_path = StudyApp_root_path + "data\\buffer.json"
-dataset_path = StudyApp_root_path + "data\\dataset.txt"
\ No newline at end of file
+log_file_path = join(data_root, "process.log")
+buffer_json_path = join(data_root, "buffer.json")
+dataset_path = join(data_root, "dataset.txt")
+global_word_freq_path = join(data_root, "global_word_freq.json")
+query_cache_path = join(data_root, "query_cache.db")
+
+embedding_path = join(data_root, "chunk_embeddings.npy")
+embedding_ids_path = join(data_root, "chunk_embeddings_ids.json")
+embedding_model_path = join(data_root, "chunk_embeddings_model.npz")
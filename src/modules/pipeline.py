@@ -0,0 +1,220 @@
+import os
+import queue
+import threading
+
+import modules.tf_idf as tf_idf
+from modules.database import get_connection
+from modules.extract_text import create_chunk_table, find_new_files, insert_file_chunks, iter_chunked_files
+from modules.path import chunk_database_path, token_json_path
+from modules.word_freq import (CHECKPOINT_EVERY, checkpoint, export_global_word_freq, get_merged_titles,
+                               init_global_freq_store, merge_existing_title_json, merge_title_counts,
+                               retrieve_token_list, write_title_json)
+
+# --- Config ---
+
+QUEUE_SIZE = 64          # Titles waiting between two stages before the producer blocks
+TOKENIZE_WORKERS = os.cpu_count() or 4
+POLL_INTERVAL = 0.5      # Seconds between checks of the abort event while blocked on a queue
+
+_DONE = object()         # End-of-stream marker passed down the queues
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Pipelined end-to-end run (--all), connected by bounded queues:
+1. Extract: chunk new .txt files in a thread pool and insert each file as soon as it is ready
+2. Tokenize: count the stemmed words of every title as soon as its chunks are in the database
+3. Aggregate: merge each title's counts into title_word_freq and the global word frequencies,
+   keyed by file name, so new files need no id from --updateDatabaseInformation yet
+4. Finalize: export the global word frequencies and compute the per-document TF-IDF weights
+   from title_word_freq; the global tf_idf table of the C++ recommender is left to --computeTFIDF
+Full queues block the upstream stage (back-pressure), so memory stays bounded. A stage that
+dies sets the shared abort event, which stops every other stage instead of leaving it blocked.
+"""
+
+def _put(q, item, abort):
+    """Put `item` on `q`, giving up once `abort` is set. Returns whether the item was queued."""
+    while not abort.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, abort):
+    """Take the next item from `q`, or _DONE once `abort` is set."""
+    while not abort.is_set():
+        try:
+            return q.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _run_stage(abort, stage, *args):
+    """Run a stage in its thread and set `abort` if it fails."""
+    try:
+        stage(*args)
+    except Exception as e:
+        print(f"[ERROR] Pipeline stage {threading.current_thread().name} failed: {e}")
+        abort.set()
+
+def extract_stage(source_folder, chunk_size, db_path, title_queue, abort):
+    """Chunk new files and hand every inserted title to the tokenize stage."""
+    conn = get_connection(db_path, "write")
+    cursor = conn.cursor()
+    create_chunk_table(conn)
+
+    new_files, num_raw_files, num_zero = find_new_files(cursor, source_folder)
+    overlap_size = int(chunk_size * 0.3)  # Assuming 30% overlap
+    print(f"[INFO] Found {len(new_files)} new files to process.")
+
+    for file, chunks, error in iter_chunked_files(sorted(new_files), source_folder, chunk_size, overlap_size):
+        if error is not None:
+            print(f"[ERROR] Failed to process {file}: {error}")
+            continue
+        try:
+            insert_file_chunks(cursor, file, chunks, overlap_size)
+            conn.commit()
+        except Exception as e:
+            print(f"[ERROR] Failed to process {file}: {e}")
+            continue
+        if not _put(title_queue, file.removesuffix(".txt"), abort):
+            return
+
+    num_completed = cursor.execute("SELECT COUNT(DISTINCT file_name) FROM pdf_chunks").fetchone()[0]
+    print(f"[INFO] {num_completed}/{num_raw_files - num_zero} files processed.")
+
+def backlog_stage(db_path, title_queue, abort):
+    """Hand every title whose chunks are already in the database but not yet counted to the tokenize stage."""
+    cursor = get_connection(db_path, "read").cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='pdf_chunks';")
+    if cursor.fetchone() is None:
+        return
+    merged = get_merged_titles(cursor)
+    # Titles still being extracted have no chunks yet; the extract stage queues them itself
+    rows = cursor.execute("SELECT DISTINCT file_name FROM pdf_chunks ORDER BY file_name").fetchall()
+    for (file_name,) in rows:
+        title = file_name.removesuffix(".txt")
+        if title not in merged and not _put(title_queue, title, abort):
+            return
+
+def tokenize_stage(db_path, title_queue, counts_queue, seen, seen_lock, abort):
+    """Count the words of each title and pass (title, title_id, counts) downstream; title_id may be None."""
+    cursor = get_connection(db_path, "read").cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_info';")
+    has_file_info = cursor.fetchone() is not None
+    while True:
+        title = _get(title_queue, abort)
+        if title is _DONE:
+            break
+        with seen_lock:
+            if title in seen:
+                continue
+            seen.add(title)
+
+        try:
+            title_id = None
+            if has_file_info:
+                row = cursor.execute("SELECT id FROM file_info WHERE file_name = ?", (title,)).fetchone()
+                title_id = row[0] if row else None
+            word_freq = retrieve_token_list(title, db_path)
+        except Exception as e:
+            # Keep consuming so upstream stages never block on a dead worker
+            print(f"[ERROR] Failed to count words of {title}: {e}")
+            continue
+        if not _put(counts_queue, (title, title_id, word_freq), abort):
+            break
+
+def aggregate_stage(db_path, counts_queue, folder_path, bounded_vocab, abort):
+    """Merge per-title counts into the global store and write title JSON files, with checkpoints."""
+    conn = get_connection(db_path, "write")
+    init_global_freq_store(conn, bounded_vocab=bounded_vocab)
+
+    merged, unnamed, pending = 0, 0, 0
+    while True:
+        item = _get(counts_queue, abort)
+        if item is _DONE:
+            break
+        title, title_id, word_freq = item
+        if not word_freq:
+            continue
+
+        try:
+            if not merge_title_counts(conn, title, word_freq, title_id, bounded_vocab):
+                continue
+            # Commit every title: the extract stage writes to the same database concurrently
+            conn.commit()
+            if title_id is not None:
+                write_title_json(title_id, word_freq, folder_path)
+        except Exception as e:
+            # Keep draining the queue so upstream stages never block on a dead consumer
+            conn.rollback()
+            print(f"[ERROR] Failed to merge word frequencies of {title}: {e}")
+            continue
+        merged += 1
+        unnamed += title_id is None
+        pending += 1
+        if pending >= CHECKPOINT_EVERY:
+            checkpoint(conn)
+            pending = 0
+
+    checkpoint(conn)
+    print(f"[INFO] Merged word frequencies of {merged} titles.")
+    if unnamed:
+        print(f"[INFO] {unnamed} titles have no entry in file_info yet; their title JSON files are written by --processWordFreq after --updateDatabaseInformation.")
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+def run_all(SOURCE_FOLDER, CHUNK_SIZE=512, DB_PATH=chunk_database_path, FOLDER_PATH=token_json_path,
+            bounded_vocab=None, workers=TOKENIZE_WORKERS, queue_size=QUEUE_SIZE):
+    """
+    Run text extraction, word counting and TF-IDF as one overlapping pipeline. A file
+    is tokenized as soon as its chunks are inserted, and its counts are merged while
+    other files are still being chunked. Per-document TF-IDF weights are computed once all
+    stages drain, from the per-title counts of this and earlier runs (title_word_freq), so
+    new files are ranked by --rankPrompt without waiting for --computeRelationalDistance.
+    """
+    os.makedirs(FOLDER_PATH, exist_ok=True)
+    title_queue = queue.Queue(maxsize=queue_size)
+    counts_queue = queue.Queue(maxsize=queue_size)
+    seen, seen_lock = set(), threading.Lock()
+    abort = threading.Event()
+
+    # Titles counted by earlier runs but not merged yet are merged from their JSON files
+    # before the backlog stage looks for titles to tokenize
+    conn = get_connection(DB_PATH, "write")
+    init_global_freq_store(conn, bounded_vocab=bounded_vocab)
+    merge_existing_title_json(conn, FOLDER_PATH, bounded_vocab)
+
+    producers = [
+        threading.Thread(target=_run_stage, args=(abort, extract_stage, SOURCE_FOLDER, CHUNK_SIZE, DB_PATH, title_queue, abort), name="extract"),
+        threading.Thread(target=_run_stage, args=(abort, backlog_stage, DB_PATH, title_queue, abort), name="backlog"),
+    ]
+    tokenizers = [
+        threading.Thread(target=_run_stage, args=(abort, tokenize_stage, DB_PATH, title_queue, counts_queue, seen, seen_lock, abort), name=f"tokenize-{i}")
+        for i in range(workers)
+    ]
+    aggregator = threading.Thread(target=_run_stage, args=(abort, aggregate_stage, DB_PATH, counts_queue, FOLDER_PATH, bounded_vocab, abort), name="aggregate")
+
+    aggregator.start()
+    for thread in tokenizers + producers:
+        thread.start()
+
+    for thread in producers:
+        thread.join()
+    for _ in tokenizers:
+        _put(title_queue, _DONE, abort)
+    for thread in tokenizers:
+        thread.join()
+    _put(counts_queue, _DONE, abort)
+    aggregator.join()
+
+    if abort.is_set():
+        raise RuntimeError("Pipeline aborted; merged titles are committed, rerun --all to resume.")
+
+    # Finalize
+    export_global_word_freq(conn, bounded_vocab=bounded_vocab)
+    tf_idf.computeTFIDF(source="title_word_freq")
@@ -0,0 +1,167 @@
+import hashlib
+import time
+from collections import OrderedDict
+from json import dumps, loads
+
+from modules.database import get_connection, get_data_version
+from modules.path import chunk_database_path, query_cache_path
+
+# --- Config ---
+
+MEMORY_CACHE_SIZE = 256       # Results kept in the in-process LRU tier
+PERSISTENT_CACHE_SIZE = 10000  # Results kept in the SQLite tier; least recently used go first
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Versioned cache for prompt lookups.
+1. Results are keyed by a hash of the stemmed token multiset (the contents of buffer.json),
+   so repeated or reordered prompts hit the same entry
+2. An in-memory LRU tier answers repeats inside one process; an optional SQLite tier
+   survives between runs, capped at PERSISTENT_CACHE_SIZE entries
+3. Every entry stores the data version it was computed at; a write to chunks, word
+   frequencies or TF-IDF bumps the version, so stale entries are never returned. The version
+   includes the generation id of the database, so a rebuilt pdf_text.db, whose counter
+   restarts at 1, never matches entries of the one it replaced
+"""
+
+def make_key(kind, tokens, **params):
+    """Hash a lookup kind, a {token: count} multiset and the lookup parameters."""
+    payload = dumps([kind, sorted(tokens.items()), sorted(params.items())], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def _as_rows(value):
+    """JSON turns tuples into lists; return row lists as lists of tuples from every tier."""
+    if isinstance(value, (list, tuple)):
+        return [tuple(row) if isinstance(row, (list, tuple)) else row for row in value]
+    return value
+
+class QueryCache:
+    """
+    Two-tier result cache. Values must be JSON serializable when `persistent_path` is set.
+
+    Parameters
+    ----------
+    db_path : str
+        Database whose data version guards the cached results.
+    persistent_path : str or None
+        SQLite file for the persistent tier; None keeps the cache in memory only.
+    maxsize : int
+        Number of entries kept in the in-memory LRU tier.
+    persistent_maxsize : int
+        Number of entries kept in the persistent tier.
+    """
+
+    def __init__(self, db_path=chunk_database_path, persistent_path=query_cache_path, maxsize=MEMORY_CACHE_SIZE,
+                 persistent_maxsize=PERSISTENT_CACHE_SIZE):
+        self.db_path = db_path
+        self.persistent_path = persistent_path
+        self.maxsize = maxsize
+        self.persistent_maxsize = persistent_maxsize
+        self._memory = OrderedDict()  # key -> ((generation, version), value)
+        self._used = {}               # key -> last hit time, written to the persistent tier by flush()
+        if persistent_path is not None:
+            conn = get_connection(persistent_path, "write")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY,
+                    generation TEXT,
+                    version INTEGER NOT NULL,
+                    result TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            columns = set(row[1] for row in conn.execute("PRAGMA table_info(query_cache)").fetchall())
+            if "generation" not in columns:
+                # Entries cached before generations existed never match (NULL) and are removed by the next put
+                conn.execute("ALTER TABLE query_cache ADD COLUMN generation TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_last_used ON query_cache (last_used)")
+            conn.commit()
+
+    def current_version(self):
+        """Return the (generation, version) of the data in db_path; see get_data_version."""
+        return get_data_version(get_connection(self.db_path, "read"))
+
+    def get(self, key, version):
+        """
+        Return the cached value for `key` computed at `version` (a (generation, version) pair), or None. Reads never write:
+        hits are only noted and their last_used time is stored by the next put or flush.
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] == version:
+                self._memory.move_to_end(key)
+                self._note_use(key)
+                return _as_rows(entry[1])
+            del self._memory[key]
+
+        if self.persistent_path is None:
+            return None
+        conn = get_connection(self.persistent_path, "read")
+        row = conn.execute("SELECT generation, version, result FROM query_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[0], row[1]) != version:
+            return None  # Stale rows are removed by the next put
+        value = loads(row[2])
+        self._remember(key, version, value)
+        self._note_use(key)
+        return _as_rows(value)
+
+    def put(self, key, version, value):
+        self._remember(key, version, value)
+        if self.persistent_path is None:
+            return
+        conn = get_connection(self.persistent_path, "write")
+        self._write_used(conn)
+        generation, number = version
+        conn.execute(
+            "INSERT OR REPLACE INTO query_cache (key, generation, version, result, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, generation, number, dumps(value, ensure_ascii=False), time.time()),
+        )
+        # Entries from older versions or from a replaced database can never be hit again
+        conn.execute("DELETE FROM query_cache WHERE generation IS NOT ? OR version < ?", (generation, number))
+        conn.execute("""
+            DELETE FROM query_cache WHERE key IN (
+                SELECT key FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.persistent_maxsize,))
+        conn.commit()
+
+    def flush(self):
+        """Store the last_used time of entries hit since the last put, in one transaction."""
+        if self.persistent_path is None or not self._used:
+            return
+        conn = get_connection(self.persistent_path, "write")
+        self._write_used(conn)
+        conn.commit()
+
+    def _note_use(self, key):
+        if self.persistent_path is not None:
+            self._used[key] = time.time()
+
+    def _write_used(self, conn):
+        conn.executemany("UPDATE query_cache SET last_used = ? WHERE key = ?", ((used, key) for key, used in self._used.items()))
+        self._used.clear()
+
+    def _remember(self, key, version, value):
+        self._memory[key] = (version, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def lookup(self, kind, tokens, compute, **params):
+        """
+        Return the cached result of `compute(tokens, **params)` for this token multiset,
+        computing and storing it if the cache has no entry at the current data version.
+        Nothing is cached while the database has no generation id yet.
+        """
+        key = make_key(kind, tokens, **params)
+        version = self.current_version()
+        if version[0] is None:
+            return _as_rows(compute(tokens, **params))
+        value = self.get(key, version)
+        if value is None:
+            value = compute(tokens, **params)
+            self.put(key, version, value)
+            value = _as_rows(value)
+        return value
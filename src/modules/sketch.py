@@ -0,0 +1,140 @@
+import math
+import zlib
+
+import numpy as np
+
+from modules.database import fetch_in
+
+# --- Config ---
+
+EPSILON = 1e-5      # Count-min overestimate is at most EPSILON * total count ...
+DELTA = 1e-3        # ... with probability 1 - DELTA
+TOP_K = 200000      # Number of heavy hitters counted exactly
+
+# -----------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------
+
+"""
+Bounded vocabulary for noisy corpora (--boundedVocab).
+1. A count-min sketch (table word_sketch) absorbs every word, so the long tail costs a fixed
+   number of counters however much OCR noise the corpus holds
+2. Only the TOP_K heaviest words are counted exactly (table heavy_word_freq); a new word enters
+   with its sketch estimate once that beats the current minimum, which it evicts
+3. Reported counts overestimate the true count by at most EPSILON * total with probability
+   1 - DELTA; both tables live in the word frequency database, so every title is merged in
+   the same transaction as its journal entry
+"""
+
+class BoundedVocab:
+    """
+    Count-min sketch plus exact top-K counts, stored in SQLite.
+
+    Parameters
+    ----------
+    epsilon : float
+        Relative error: estimates exceed the true count by at most epsilon * total.
+    delta : float
+        Probability that an estimate exceeds that bound.
+    top_k : int
+        Number of heavy hitters counted exactly.
+    """
+
+    def __init__(self, epsilon=EPSILON, delta=DELTA, top_k=TOP_K):
+        if not 0 < epsilon < 1 or not 0 < delta < 1 or top_k < 1:
+            raise ValueError(f"Invalid bounded vocabulary settings: epsilon={epsilon}, delta={delta}, top_k={top_k}")
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.top_k = top_k
+
+    def describe(self):
+        """Settings string stored with the word frequencies; counts from other settings cannot be mixed in."""
+        return f"bounded:{self.width}x{self.depth}:top{self.top_k}"
+
+    def create_tables(self, conn, reset=False):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS word_sketch (
+                cell INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS heavy_word_freq (
+                word TEXT PRIMARY KEY,
+                freq INTEGER NOT NULL,
+                error INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_heavy_word_freq_freq ON heavy_word_freq (freq)")
+        if reset:
+            conn.execute("DELETE FROM word_sketch")
+            conn.execute("DELETE FROM heavy_word_freq")
+
+    def _cells(self, words):
+        """Return a (len(words), depth) array of sketch cells, one crc32 seed per row."""
+        encoded = [word.encode("utf-8") for word in words]
+        columns = np.array(
+            [[zlib.crc32(word, row) % self.width for row in range(self.depth)] for word in encoded],
+            dtype=np.int64,
+        ).reshape(len(encoded), self.depth)
+        return columns + np.arange(self.depth, dtype=np.int64) * self.width
+
+    def merge(self, conn, word_freq):
+        """
+        Add the {word: count} mapping of one title inside the caller's transaction.
+
+        Returns
+        -------
+        set
+            The words of `word_freq` that are heavy hitters after the merge.
+        """
+        if not word_freq:
+            return set()
+        words = list(word_freq.keys())
+        counts = np.fromiter(word_freq.values(), dtype=np.int64, count=len(words))
+        cells = self._cells(words)
+
+        # Step 1: Every word goes into the sketch
+        unique_cells, inverse = np.unique(cells.ravel(), return_inverse=True)
+        increments = np.bincount(inverse, weights=np.repeat(counts, self.depth)).astype(np.int64)
+        conn.executemany("""
+            INSERT INTO word_sketch (cell, count) VALUES (?, ?)
+            ON CONFLICT(cell) DO UPDATE SET count = count + excluded.count
+        """, zip(unique_cells.tolist(), increments.tolist()))
+
+        # Step 2: Heavy hitters already tracked are counted exactly
+        heavy = set(row[0] for row in fetch_in(conn, "SELECT word FROM heavy_word_freq WHERE word IN {keys}", words))
+        conn.executemany(
+            "UPDATE heavy_word_freq SET freq = freq + ? WHERE word = ?",
+            ((word_freq[word], word) for word in heavy),
+        )
+
+        candidates = [i for i, word in enumerate(words) if word not in heavy]
+        if not candidates:
+            return heavy
+
+        # Step 3: Other words enter with their sketch estimate (which includes this title)
+        cell_counts = dict(fetch_in(conn, "SELECT cell, count FROM word_sketch WHERE cell IN {keys}", np.unique(cells[candidates]).tolist()))
+        estimates = np.array([[cell_counts[cell] for cell in row] for row in cells[candidates].tolist()], dtype=np.int64).min(axis=1)
+        order = np.argsort(-estimates, kind="stable")
+        entries = [(words[candidates[i]], int(estimates[i]), int(estimates[i] - counts[candidates[i]])) for i in order]
+
+        free = self.top_k - conn.execute("SELECT COUNT(*) FROM heavy_word_freq").fetchone()[0]
+        admitted, entries = entries[:max(free, 0)], entries[max(free, 0):]
+        if entries:
+            # Pairing the largest candidates with the smallest heavy hitters is what admitting
+            # them one at a time, each evicting the current minimum, would do
+            victims = conn.execute("SELECT word, freq FROM heavy_word_freq ORDER BY freq LIMIT ?", (len(entries),)).fetchall()
+            replaced = 0
+            for (word, estimate, _), (_, victim_freq) in zip(entries, victims):
+                if estimate <= victim_freq:
+                    break
+                replaced += 1
+            conn.executemany("DELETE FROM heavy_word_freq WHERE word = ?", ((word,) for word, _ in victims[:replaced]))
+            admitted += entries[:replaced]
+        conn.executemany("INSERT INTO heavy_word_freq (word, freq, error) VALUES (?, ?, ?)", admitted)
+        return heavy | set(word for word, _, _ in admitted)
+
+    def error_bound(self, conn):
+        """Maximum overestimate of a reported count (holds with probability 1 - delta)."""
+        total = conn.execute("SELECT COALESCE(SUM(count), 0) FROM word_sketch WHERE cell < ?", (self.width,)).fetchone()[0]
+        return math.e / self.width * total
@@ -1,20 +1,129 @@
-import sqlite3
 import ujson as json  # Much faster
-import math
-from modules.path import chunk_database_path
+import numpy as np
+from collections import defaultdict
+from operator import itemgetter
+from modules.database import get_connection, bump_data_version, fetch_in
+from modules.path import chunk_database_path, global_word_freq_path
 
-GLOBAL_JSON_PATH = "data/global_word_freq.json"
+GLOBAL_JSON_PATH = global_word_freq_path
 MIN_THRES_FREQ = 4
 BUFFER_SIZE = 1000
+DOC_BUFFER_SIZE = 100000  # Rows per executemany when writing per-document weights
+FETCH_SIZE = 100000       # Rows per fetchmany when loading term counts
 
-def computeTFIDF():
-    conn = sqlite3.connect(chunk_database_path)
+# Per-document term counts keyed by the file_info file name: relation_distance (rows named
+# title_<id>) is refreshed by --computeRelationalDistance, title_word_freq by the Python word
+# counting (--processWordFreq, --all, --mergePartitions)
+TERM_COUNT_QUERIES = {
+    "relation_distance": """
+        SELECT f.file_name, r.token, r.frequency
+        FROM file_info f JOIN relation_distance r ON r.file_name = 'title_' || f.id
+    """,
+    "title_word_freq": "SELECT file_name, word, freq FROM title_word_freq",
+}
+
+def load_term_counts(cursor, source="relation_distance"):
+    """
+    Load every (file_name, token, frequency) row of the `source` table into flat arrays.
+    Each fetched batch is encoded with C-level map/dict lookups instead of a Python loop per
+    row, and only integer codes are kept, not millions of name references.
+
+    Returns
+    -------
+    tuple
+        (doc_names, tokens, doc_idx, token_idx, freq) where doc_names and tokens are lists
+        of distinct names and the three arrays hold one entry per (document, token) pair.
+    """
+    doc_codes = defaultdict(lambda: len(doc_codes))      # Unseen names get the next code
+    token_codes = defaultdict(lambda: len(token_codes))
+    doc_idx, token_idx, freq = [], [], []
+
+    cursor.execute(TERM_COUNT_QUERIES[source])
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        n = len(rows)
+        doc_idx.append(np.fromiter(map(doc_codes.__getitem__, map(itemgetter(0), rows)), dtype=np.int64, count=n))
+        token_idx.append(np.fromiter(map(token_codes.__getitem__, map(itemgetter(1), rows)), dtype=np.int64, count=n))
+        freq.append(np.fromiter(map(itemgetter(2), rows), dtype=np.float64, count=n))
+
+    def concat(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    return (
+        list(doc_codes.keys()),
+        list(token_codes.keys()),
+        concat(doc_idx, np.int64),
+        concat(token_idx, np.int64),
+        concat(freq, np.float64),
+    )
+
+def compute_document_weights(doc_idx, token_idx, freq, n_docs, n_tokens):
+    """
+    Compute L2-normalized log-scaled TF-IDF weights for every (document, token) pair.
+
+    tf = 1 + log10(frequency), idf = log10((n_docs + 1) / (doc_count + 1)) + 1
+
+    Returns
+    -------
+    tuple
+        (weights, norms, doc_count) where weights is aligned with the input arrays,
+        norms holds the L2 norm of each document before normalization and doc_count
+        the number of documents each token appears in.
+    """
+    doc_count = np.bincount(token_idx, minlength=n_tokens)
+    idf = np.log10((n_docs + 1) / (doc_count + 1)) + 1
+
+    weights = (1 + np.log10(np.maximum(freq, 1))) * idf[token_idx]
+    norms = np.sqrt(np.bincount(doc_idx, weights=weights * weights, minlength=n_docs))
+    weights /= np.where(norms > 0, norms, 1)[doc_idx]
+    return weights, norms, doc_count
+
+def store_document_weights(conn, doc_names, tokens, doc_idx, token_idx, weights, norms):
+    """
+    Replace the tf_idf_doc and doc_norm tables with freshly computed weights.
+
+    tf_idf_doc is rebuilt rather than emptied: rows are inserted in primary key order into a
+    new table and the token index is created once at the end, instead of maintaining both
+    b-trees row by row.
+    """
     cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS tf_idf_doc")
+    cursor.execute("""
+        CREATE TABLE tf_idf_doc (
+            file_name TEXT,
+            token TEXT,
+            weight REAL,
+            PRIMARY KEY (file_name, token)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS doc_norm (
+            file_name TEXT PRIMARY KEY,
+            norm REAL
+        )
+    """)
+    cursor.execute("DELETE FROM doc_norm")
+    cursor.executemany("INSERT INTO doc_norm (file_name, norm) VALUES (?, ?)", zip(doc_names, norms.tolist()))
 
-    # Speed-boosting pragmas
-    cursor.execute("PRAGMA journal_mode=WAL;")
-    cursor.execute("PRAGMA synchronous = OFF;")
+    # Insert in primary key order: rank the distinct names once, then sort the pairs by rank
+    doc_names, tokens = np.array(doc_names, dtype=object), np.array(tokens, dtype=object)
+    doc_rank, token_rank = np.empty(len(doc_names), dtype=np.int64), np.empty(len(tokens), dtype=np.int64)
+    doc_rank[np.argsort(doc_names)] = np.arange(len(doc_names))
+    token_rank[np.argsort(tokens)] = np.arange(len(tokens))
+    order = np.lexsort((token_rank[token_idx], doc_rank[doc_idx]))
+    for start in range(0, len(order), DOC_BUFFER_SIZE):
+        batch = order[start:start + DOC_BUFFER_SIZE]
+        cursor.executemany(
+            "INSERT INTO tf_idf_doc (file_name, token, weight) VALUES (?, ?, ?)",
+            zip(doc_names[doc_idx[batch]].tolist(), tokens[token_idx[batch]].tolist(), weights[batch].tolist()),
+        )
+    cursor.execute("CREATE INDEX idx_tf_idf_doc_token ON tf_idf_doc (token)")
 
+def store_global_tfidf(conn, tokens, doc_count, total_docs):
+    """Upsert the global tf_idf table read by the C++ recommender from the global word frequencies."""
+    cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS tf_idf (
             word TEXT PRIMARY KEY,
@@ -31,41 +140,17 @@ def computeTFIDF():
         word: freq for word, freq in global_word_freq.items()
         if freq >= MIN_THRES_FREQ or len(word.strip()) > 1
     }
+    word_doc_counts = dict(zip(tokens, doc_count.tolist()))
 
-    sum_freq = sum(filtered_words.values())
+    # Global score per word, computed for all words at once
+    words = list(filtered_words.keys())
+    word_freqs = np.array(list(filtered_words.values()), dtype=np.float64)
+    word_docs = np.array([word_doc_counts.get(word, 0) for word in words], dtype=np.float64)
+    sum_freq = word_freqs.sum()
+    tf_idf = word_freqs / sum_freq * (np.log10((total_docs + 1) / (word_docs + 1)) + 1)
 
-    cursor.execute("""
-        SELECT token, COUNT(DISTINCT file_name)
-        FROM relation_distance
-        GROUP BY token
-    """)
-    word_doc_counts = dict(cursor.fetchall())
-
-    total_docs = cursor.execute("SELECT COUNT(DISTINCT file_name) FROM relation_distance").fetchone()[0]
-
-    buffer = []
-    conn.execute("BEGIN TRANSACTION;")  # Wrap all insertions
-
-    for i, (word, freq) in enumerate(filtered_words.items(), 1):
-        doc_count = word_doc_counts.get(word, 0)
-        tf = freq / sum_freq
-        idf = math.log10((total_docs + 1) / (doc_count + 1)) + 1
-        tf_idf = tf * idf
-
-        buffer.append((word, freq, doc_count, tf_idf))
-
-        if len(buffer) == BUFFER_SIZE:
-            cursor.executemany("""
-                INSERT INTO tf_idf (word, freq, doc_count, tf_idf)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(word) DO UPDATE SET
-                    freq=excluded.freq,
-                    doc_count=excluded.doc_count,
-                    tf_idf=excluded.tf_idf
-            """, buffer)
-            buffer.clear()
-
-    if buffer:
+    records = list(zip(words, word_freqs.astype(np.int64).tolist(), word_docs.astype(np.int64).tolist(), tf_idf.tolist()))
+    for start in range(0, len(records), BUFFER_SIZE):
         cursor.executemany("""
             INSERT INTO tf_idf (word, freq, doc_count, tf_idf)
             VALUES (?, ?, ?, ?)
@@ -73,8 +158,63 @@ def computeTFIDF():
                 freq=excluded.freq,
                 doc_count=excluded.doc_count,
                 tf_idf=excluded.tf_idf
-        """, buffer)
+        """, records[start:start + BUFFER_SIZE])
+
+def computeTFIDF(source="relation_distance"):
+    """
+    Compute the per-document weights from the term counts of `source` ("relation_distance"
+    or "title_word_freq", see TERM_COUNT_QUERIES); documents are keyed by file name either way.
+
+    Only the relation_distance source also rewrites the global tf_idf table read by the C++
+    recommender, so its document counts always come from the filtered C++ tokens.
+    """
+    # Pooled connection with the speed-boosting write pragmas
+    conn = get_connection(chunk_database_path, "write")
+    cursor = conn.cursor()
+
+    # Per-document term counts, one row per (file_name, token)
+    doc_names, tokens, doc_idx, token_idx, freq = load_term_counts(cursor, source)
+    total_docs = len(doc_names)
+    weights, norms, doc_count = compute_document_weights(doc_idx, token_idx, freq, total_docs, len(tokens))
+
+    conn.execute("BEGIN TRANSACTION;")  # Wrap all insertions
+
+    if source == "relation_distance":
+        store_global_tfidf(conn, tokens, doc_count, total_docs)
+    store_document_weights(conn, doc_names, tokens, doc_idx, token_idx, weights, norms)
+    bump_data_version(conn)
 
     conn.commit()
-    conn.close()
-    print("TF-IDF computation completed.")
+    print(f"TF-IDF computation completed ({len(weights)} document-token weights over {total_docs} documents).")
+
+def rank_documents(query_tokens, top_n=10, db_path=chunk_database_path):
+    """
+    Rank documents against a {token: count} query with the normalized weights of tf_idf_doc.
+
+    The query is weighted with the same log-scaled tf; documents are scored by the dot
+    product with the L2-normalized query (cosine similarity, as document weights are
+    already normalized).
+
+    Returns
+    -------
+    list
+        Up to top_n (file_name, score) tuples, best first.
+    """
+    if not query_tokens:
+        return []
+    conn = get_connection(db_path, "read")
+    rows = fetch_in(conn, "SELECT file_name, token, weight FROM tf_idf_doc WHERE token IN {keys}", query_tokens.keys())
+    if not rows:
+        return []
+
+    query_weight = {token: 1 + np.log10(count) for token, count in query_tokens.items() if count > 0}
+    query_norm = np.sqrt(sum(weight * weight for weight in query_weight.values()))
+
+    doc_codes = {}
+    doc_idx = np.array([doc_codes.setdefault(file_name, len(doc_codes)) for file_name, _, _ in rows], dtype=np.int64)
+    contributions = np.array([weight * query_weight.get(token, 0.0) for _, token, weight in rows], dtype=np.float64)
+    scores = np.bincount(doc_idx, weights=contributions, minlength=len(doc_codes)) / query_norm
+
+    doc_names = list(doc_codes.keys())
+    best = np.argsort(-scores, kind="stable")[:top_n]
+    return [(doc_names[i], float(scores[i])) for i in best]
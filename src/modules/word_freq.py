@@ -4,15 +4,20 @@ import re
 import nltk
 from collections import defaultdict
 from shutil import rmtree
-from modules.path import chunk_database_path, token_json_path, buffer_json_path, dataset_path, log_file_path
+from modules.database import get_connection, fetch_in, bump_data_version
+from modules.path import chunk_database_path, token_json_path, buffer_json_path, dataset_path, log_file_path, global_word_freq_path
 from nltk.stem import PorterStemmer
 from nltk.corpus import stopwords
 from concurrent.futures import ThreadPoolExecutor
-from json import dump
+from json import dump, dumps, load
 import string
 from functools import partial
 from subprocess import run
 
+# Titles merged into the global word frequencies per commit
+CHECKPOINT_EVERY = 20
+EXPORT_FETCH_SIZE = 50000
+
 # One-time compiled regex pattern
 REPEATED_CHAR_PATTERN = re.compile(r"([a-zA-Z])\1{2,}")
 
@@ -150,10 +155,10 @@ def retrieve_token_list(title_id, database):
     Notes
     -----
     This function uses a generator to process each chunk one at a time to minimize memory usage.
-    It also handles invalid data and SQLite errors gracefully.
+    It also handles invalid data and SQLite errors gracefully. Each worker thread
+    reuses its own pooled read connection instead of opening one per title.
     """
-    conn = sqlite3.connect(database)
-    cursor = conn.cursor()
+    cursor = get_connection(database, "read").cursor()
 
     clean_text_dict = defaultdict(int)
     try:
@@ -170,21 +175,220 @@ def retrieve_token_list(title_id, database):
     except sqlite3.Error as e:
         print(f"SQLite error while retrieving token list for title ID {title_id}: {e}")
     finally:
-        conn.close()  # Ensure the connection is closed
+        cursor.close()
 
     return clean_text_dict
 
+# Persistent global word frequencies, merged one finished title at a time
+def init_global_freq_store(conn, reset=False, bounded_vocab=None):
+    """
+    Create the tables holding the global word frequencies, the per-title counts and the
+    journal of titles already merged. With reset=True all of them are emptied.
+
+    With a `bounded_vocab` (modules.sketch.BoundedVocab), global counts go to its sketch and
+    heavy hitter tables instead of global_word_freq. The counting mode is recorded, and
+    merging into a store counted in another mode raises ValueError.
+
+    Titles are keyed by file name, so a title can be counted before --updateDatabaseInformation
+    has given it an id in file_info; its title JSON file is written once the id exists
+    (see write_missing_title_json).
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS global_word_freq (
+            word TEXT PRIMARY KEY,
+            freq INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS word_freq_journal (
+            file_name TEXT PRIMARY KEY,
+            title_id TEXT,
+            completed_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS word_freq_settings (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            mode TEXT NOT NULL
+        )
+    """)
+    create_title_word_freq_table(conn)
+    if bounded_vocab:
+        bounded_vocab.create_tables(conn, reset)
+    if reset:
+        conn.execute("DELETE FROM global_word_freq")
+        conn.execute("DELETE FROM word_freq_journal")
+        conn.execute("DELETE FROM title_word_freq")
+
+    mode = bounded_vocab.describe() if bounded_vocab else "exact"
+    row = conn.execute("SELECT mode FROM word_freq_settings WHERE id = 0").fetchone()
+    if row is not None and row[0] != mode and conn.execute("SELECT 1 FROM word_freq_journal LIMIT 1").fetchone():
+        conn.rollback()
+        raise ValueError(f"Word frequencies were counted in mode {row[0]}, not {mode}; rerun with the same --boundedVocab settings.")
+    conn.execute("INSERT OR REPLACE INTO word_freq_settings (id, mode) VALUES (0, ?)", (mode,))
+    conn.commit()
+
+def create_title_word_freq_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS title_word_freq (
+            file_name TEXT,
+            word TEXT,
+            freq INTEGER,
+            PRIMARY KEY (file_name, word)
+        )
+    """)
+
+def get_merged_titles(cursor):
+    """Return the set of file names whose counts are already in global_word_freq."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='word_freq_journal';")
+    if cursor.fetchone() is None:
+        return set()
+    return set(row[0] for row in cursor.execute("SELECT file_name FROM word_freq_journal").fetchall())
+
+def merge_title_counts(conn, file_name, word_freq, title_id=None, bounded_vocab=None):
+    """
+    Store the word frequencies of one title in title_word_freq, add them to global_word_freq
+    and record the title in the journal. All writes belong to the caller's transaction, so a
+    title is either fully merged or not at all; a title already in the journal is never merged
+    twice. Returns whether the title was merged.
+
+    With a `bounded_vocab`, the counts go through its sketch and only the title's words that
+    are heavy hitters are kept in title_word_freq, so neither table grows with OCR noise.
+    """
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO word_freq_journal (file_name, title_id) VALUES (?, ?)",
+        (file_name, title_id),
+    )
+    if cursor.rowcount == 0:
+        return False
+    if bounded_vocab:
+        heavy = bounded_vocab.merge(conn, word_freq)
+        word_freq = {word: freq for word, freq in word_freq.items() if word in heavy}
+    else:
+        conn.executemany("""
+            INSERT INTO global_word_freq (word, freq) VALUES (?, ?)
+            ON CONFLICT(word) DO UPDATE SET freq = freq + excluded.freq
+        """, word_freq.items())
+    conn.execute("DELETE FROM title_word_freq WHERE file_name = ?", (file_name,))
+    conn.executemany(
+        "INSERT INTO title_word_freq (file_name, word, freq) VALUES (?, ?, ?)",
+        ((file_name, word, freq) for word, freq in word_freq.items()),
+    )
+    bump_data_version(conn)
+    return True
+
+def checkpoint(conn):
+    """Commit merged titles and fold the WAL back into the database file."""
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+
+def merge_title_json_files(conn, titles, folder_path=token_json_path, bounded_vocab=None):
+    """Merge existing title_*.json files of (file_name, title_id) pairs into the global store without recounting their chunks."""
+    pending = 0
+    for file_name, title_id in titles:
+        with open(os.path.join(folder_path, f'title_{title_id}.json'), 'r', encoding='utf-8') as f:
+            word_freq = load(f)
+        merge_title_counts(conn, file_name, word_freq, title_id, bounded_vocab)
+        pending += 1
+        if pending >= CHECKPOINT_EVERY:
+            checkpoint(conn)
+            pending = 0
+    checkpoint(conn)
+
+def merge_existing_title_json(conn, folder_path=token_json_path, bounded_vocab=None):
+    """
+    Merge every title of file_info that is not in the journal yet but already has a title JSON
+    file, so it is never recounted. Returns the number of titles merged.
+    """
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_info';")
+    if cursor.fetchone() is None or not os.path.isdir(folder_path):
+        return 0
+    titleID_json = get_title_ids_from_json(folder_path)
+    merged_titles = get_merged_titles(conn.cursor())
+    titles = sorted(
+        (title, titleID) for title, titleID in get_title_ids(conn.cursor()).items()
+        if title not in merged_titles and titleID in titleID_json
+    )
+    if titles:
+        print(f"Merging {len(titles)} existing title JSON files into global word frequencies.")
+        merge_title_json_files(conn, titles, folder_path, bounded_vocab)
+    return len(titles)
+
+def write_missing_title_json(conn, folder_path=token_json_path):
+    """
+    Write the title JSON file of every merged title that has an id in file_info but no file
+    yet, e.g. titles counted by --all or merged from partitions before --updateDatabaseInformation.
+    In bounded vocabulary mode these files only hold the title's heavy hitters. Returns the number of merged titles still without an id.
+    """
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_info';")
+    if cursor.fetchone() is None:
+        return conn.execute("SELECT COUNT(*) FROM word_freq_journal").fetchone()[0]
+
+    rows = conn.execute("""
+        SELECT j.file_name, f.id FROM word_freq_journal j
+        LEFT JOIN file_info f ON f.file_name = j.file_name
+    """).fetchall()
+    written = 0
+    for file_name, title_id in rows:
+        if title_id is None or os.path.exists(os.path.join(folder_path, f'title_{title_id}.json')):
+            continue
+        word_freq = dict(conn.execute("SELECT word, freq FROM title_word_freq WHERE file_name = ?", (file_name,)).fetchall())
+        write_title_json(title_id, word_freq, folder_path)
+        written += 1
+    if written:
+        print(f"Wrote {written} title JSON files of titles counted before they had an id.")
+    return sum(1 for _, title_id in rows if title_id is None)
+
+def export_global_word_freq(conn, json_path=global_word_freq_path, bounded_vocab=None):
+    """
+    Write the global word frequencies to the JSON file read by computeTFIDF, streaming rows
+    so the full vocabulary is never held in memory. The file is replaced atomically.
+    With a `bounded_vocab`, the heavy hitters are written, most frequent first.
+    """
+    if bounded_vocab:
+        cursor = conn.execute("SELECT word, freq FROM heavy_word_freq ORDER BY freq DESC, word")
+    else:
+        cursor = conn.execute("SELECT word, freq FROM global_word_freq")
+
+    tmp_path = json_path + ".tmp"
+    exported = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("{")
+        separator = "\n"
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for word, freq in rows:
+                f.write(f"{separator}    {dumps(word, ensure_ascii=False)}: {freq}")
+                separator = ",\n"
+            exported += len(rows)
+        f.write("\n}")
+
+    os.replace(tmp_path, json_path)
+    if bounded_vocab:
+        print(f"Exported {exported} heavy hitters (max overestimate {bounded_vocab.error_bound(conn):.1f}).")
+
+def write_title_json(title_id, word_freq, folder_path=token_json_path):
+    """Atomically write the word frequencies of one title to title_<title_id>.json."""
+    json_file_path = os.path.join(folder_path, f'title_{title_id}.json')
+    with open(json_file_path + ".tmp", 'w', encoding='utf-8') as f:
+        dump(word_freq, f, ensure_ascii=False, indent=4)
+    os.replace(json_file_path + ".tmp", json_file_path)
+
 # Process chunks in batches and store word frequencies in individual JSON files
-def process_chunks_in_batches(database, pdf_titles, fetched_result):
+def process_chunks_in_batches(database, pdf_titles, fetched_result, bounded_vocab=None):
     """
     Process chunks in batches and store word frequencies in individual JSON files.
 
     This function takes a list of title IDs, a dictionary of title IDs to starting IDs and chunk counts, and a connection to a SQLite database.
     It processes chunks in batches and stores word frequencies in individual JSON files in the `token_json_path` folder.
-    It also keeps track of the global word frequencies and stores them in a single JSON file after all titles have been processed.
+    Each finished title is merged into the persistent global_word_freq table, committed every
+    CHECKPOINT_EVERY titles, so an interrupted run resumes without losing or double-counting work.
+    The global JSON file is then exported from the table (see export_global_word_freq).
     """
-    
-    global_word_freq = defaultdict(int)
+    conn = get_connection(database, "write")
+    init_global_freq_store(conn, bounded_vocab=bounded_vocab)
 
     # Ensure the directory exists
     os.makedirs(token_json_path, exist_ok=True)
@@ -192,26 +396,27 @@ def process_chunks_in_batches(database, pdf_titles, fetched_result):
     # Partial function to bind database parameter for parallel processing
     retrieve_func = partial(retrieve_token_list, database=database)
 
+    pending = 0
     # Process title IDs in parallel (each thread gets its own connection)
     with ThreadPoolExecutor() as executor:
         for title_id, word_freq in zip(pdf_titles, executor.map(retrieve_func, pdf_titles)):
             if word_freq is None or len(word_freq) == 0:
                 continue
-            
-            # Update global word frequencies
-            for word, freq in word_freq.items():
-                global_word_freq[word] += freq
 
             # Dump word frequencies for each title into a separate JSON file immediately
-            json_file_path = os.path.join(token_json_path, f'title_{fetched_result[title_id]}.json')
-            with open(json_file_path, 'w', encoding='utf-8') as f:
-                dump(word_freq, f, ensure_ascii=False, indent=4)
+            write_title_json(fetched_result[title_id], word_freq)
 
+            # Update global word frequencies
+            merge_title_counts(conn, title_id, word_freq, fetched_result[title_id], bounded_vocab)
+            pending += 1
+            if pending >= CHECKPOINT_EVERY:
+                checkpoint(conn)
+                pending = 0
+
+    checkpoint(conn)
     print("All titles processed and word frequencies stored in individual JSON files.")
 
-    json_global_path = os.path.join(os.getcwd(), 'data', 'global_word_freq.json')
-    with open(json_global_path, 'w', encoding='utf-8') as f:
-        dump(global_word_freq, f, ensure_ascii=False, indent=4)
+    export_global_word_freq(conn, bounded_vocab=bounded_vocab)
     print("Global word frequencies inserted into the database.")
 
 # Retrieve title IDs from JSON files with pattern title_*.json -> *
@@ -236,18 +441,19 @@ def get_title_ids_from_json(folder_path):
     return title_ids
 
 # Main function to process word frequencies in batches
-def process_word_frequencies_in_batches(reset_state=False, folder_path=token_json_path):
+def process_word_frequencies_in_batches(reset_state=False, folder_path=token_json_path, bounded_vocab=None):
     """
     Process word frequencies in batches and store them in individual JSON files.
 
     Args:
         reset_state (bool, optional): If True, delete the existing folder and recreate it. Defaults to False.
+        bounded_vocab (BoundedVocab, optional): Count global word frequencies with a count-min sketch and exact heavy hitters only (see modules.sketch). Defaults to None.
         folder_path (str, optional): The path to the folder where the JSON files will be saved. Defaults to token_json_path.
 
-    If reset_state is False, the function will check if there are any missing title IDs in the folder and process them. If there are no missing title IDs, the function will print a message and do nothing.
+    If reset_state is False, the function merges title JSON files that are not yet in the global word frequencies, writes the JSON files of titles
+    merged before they had an id, counts the titles that have neither, and then exports the global JSON file again. The export also happens when no titles are missing, so the JSON file always matches the database.
     """
-    conn = sqlite3.connect(chunk_database_path, check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_connection(chunk_database_path, "read").cursor()
 
     print("Starting batch processing of chunks...")
 
@@ -260,48 +466,58 @@ def process_word_frequencies_in_batches(reset_state=False, folder_path=token_jso
         if os.path.exists(folder_path):
             rmtree(folder_path)
         os.makedirs(folder_path)
+        init_global_freq_store(get_connection(chunk_database_path, "write"), reset=True, bounded_vocab=bounded_vocab)
         fetched_result = get_title_ids(cursor)
         pdf_titles = list(fetched_result.keys())
-        process_chunks_in_batches(database=chunk_database_path, pdf_titles=pdf_titles, fetched_result=fetched_result)
+        process_chunks_in_batches(database=chunk_database_path, pdf_titles=pdf_titles, fetched_result=fetched_result, bounded_vocab=bounded_vocab)
     else:
-        # Retrieve title IDs from the database
-        titleID_db = cursor.execute("SELECT id FROM file_info WHERE chunk_count > 0").fetchall()
-        titleID_db = set([title[0] for title in titleID_db])
+        # Retrieve titles and their IDs from the database
+        titles_db = get_title_ids(cursor)
         # Retrieve title IDs from JSON files
         titleID_json = set(get_title_ids_from_json(folder_path))
-        if table_exists:
-            # Retrieve completed title IDs from the database
-            titleID_complete = cursor.execute("SELECT file_name FROM file_token").fetchall()
-            titleID_complete = set([title[0].removeprefix("title_") for title in titleID_complete])
-        else:
-            titleID_complete = set()
-        # Find the difference between the two sets
-        titleID_diff = titleID_db.difference(titleID_json).difference(titleID_complete)
-        print(f"{len(titleID_db)} title IDs in database, {len(titleID_json)} title IDs in JSON files, {len(titleID_complete)} completed title IDs.")
+        # Retrieve titles already merged into the global word frequencies
+        merged_titles = get_merged_titles(cursor)
+        # Find the titles that are not merged yet, with and without a JSON file
+        missing = {title: titleID for title, titleID in titles_db.items() if title not in merged_titles}
+        titles_from_json = sorted((title, titleID) for title, titleID in missing.items() if titleID in titleID_json)
+        titleID_diff = set(titleID for titleID in missing.values() if titleID not in titleID_json)
+        print(f"{len(titles_db)} title IDs in database, {len(titleID_json)} title IDs in JSON files, {len(merged_titles)} merged titles.")
         print(f"Found {len(titleID_diff)} missing title IDs to process.")
+
+        conn = get_connection(chunk_database_path, "write")
+        init_global_freq_store(conn, bounded_vocab=bounded_vocab)
+        if titles_from_json:
+            # Counts of these titles already exist on disk, merge them without recounting
+            print(f"Merging {len(titles_from_json)} existing title JSON files into global word frequencies.")
+            merge_title_json_files(conn, titles_from_json, folder_path, bounded_vocab)
+        # Titles merged before they had an id (--all, --mergePartitions) still need their JSON file
+        write_missing_title_json(conn, folder_path)
+
         # If there are any missing title IDs, process them
         if titleID_diff:
-            titleID_diff = list(titleID_diff)
-            pdf_titles = [cursor.execute("SELECT file_name FROM file_info WHERE id = ? ORDER BY chunk_count", (titleID,)).fetchone()[0] for titleID in titleID_diff]
-            fetched_result = {title: titleID for title, titleID in zip(pdf_titles, titleID_diff)}
-            process_chunks_in_batches(database=chunk_database_path, pdf_titles=pdf_titles, fetched_result=fetched_result)
+            # One bulk lookup instead of one query per title ID
+            rows = fetch_in(cursor.connection, "SELECT file_name, id, chunk_count FROM file_info WHERE id IN {keys}", titleID_diff)
+            rows.sort(key=lambda row: row[2])
+            fetched_result = {title: titleID for title, titleID, _ in rows}
+            pdf_titles = list(fetched_result.keys())
+            process_chunks_in_batches(database=chunk_database_path, pdf_titles=pdf_titles, fetched_result=fetched_result, bounded_vocab=bounded_vocab)
         else:
+            export_global_word_freq(conn, bounded_vocab=bounded_vocab)
             print("All titles have been processed. No new titles to process.")
 
     print("Processing word frequencies complete.")
-    conn.commit()
-    conn.close()
+    cursor.close()
 
 # _________________________________________________________________________________
 # _________________________________________________________________________________
 
-def promptFindingReference() -> None:
+def promptFindingReference() -> dict:
     """Reads in a prompt from a text file, cleans the text, and stores the cleaned
     prompt in a JSON file. The prompt is cleaned by removing punctuation, converting
     to lowercase, tokenizing, removing stop words, removing words with repeated
     characters, and stemming. If the cleaned prompt is empty, a message is printed
     and the function returns early. Otherwise, the cleaned prompt is stored in the
-    buffer.json file."""
+    buffer.json file. The cleaned prompt is also returned."""
     def clean_prompt(text: str):
         # Remove punctuation and convert to lowercase
         text = re.sub(r'[^\w\s]', ' ', text).lower()
@@ -335,3 +551,5 @@ def promptFindingReference() -> None:
     # Dump the cleaned prompt to the buffer.json file
     with open(buffer_json_path, "w") as f:
         dump(cleaned_prompt, f, ensure_ascii=False, indent=4)
+
+    return cleaned_prompt